@@ -1,17 +1,24 @@
 from fastapi import FastAPI, Query, BackgroundTasks, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from functools import wraps
+from functools import lru_cache, wraps
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import os
 import asyncio
 import logging
 
 from recommender.hybrid_recommender import HybridRecommender
-from recommender.prepare_data import prepare_steam_data_optimized
+from recommender.prepare_data import (
+    GAMES_DTYPES,
+    RATINGS_DTYPES,
+    prepare_steam_data_optimized,
+    convert_prepared_csv_to_parquet
+)
 from evaluator.evaluator import Evaluator
 
 # DB & Models 
-from db.database import get_db, init_db
+from db.database import SessionLocal, engine, get_db, init_db
 from db.models import JobType, JobStatus, Job
 from db.job_utils import (
     create_job, 
@@ -31,9 +38,14 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Paths 
-MODEL_PATH = "models/recommender.pkl"
-GAMES_OUT = "data/games_prepared.csv.gz"
-RATINGS_OUT = "data/ratings_prepared.csv.gz"
+MODEL_PATH = "models/recommender"
+LEGACY_MODEL_PATH = "models/recommender.pkl"
+GAMES_OUT = "data/games_prepared.parquet"
+RATINGS_OUT = "data/ratings_prepared.parquet"
+LEGACY_GAMES_OUT = "data/games_prepared.csv.gz"
+LEGACY_RATINGS_OUT = "data/ratings_prepared.csv.gz"
+
+API_THREAD_WORKERS = 4
 
 # FastAPI App
 app = FastAPI(title="Steam Hybrid Recommender API")
@@ -51,6 +63,33 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Job Executor
+def init_job_worker():
+    # Don't reuse DB connections inherited from the parent process
+    engine.dispose(close=False)
+
+# Training/evaluation are CPU-bound, run them in a separate process so they never hold the API's GIL
+job_executor = ProcessPoolExecutor(max_workers=1, initializer=init_job_worker)
+
+async def run_in_job_executor(func, job_id, *args):
+    """
+    Run a job handler in the job worker. If the worker dies (e.g. OOM-killed) the
+    job is marked failed, and the broken pool is replaced so later jobs still run.
+    """
+    global job_executor
+    executor = job_executor
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor, func, job_id, *args)
+    except Exception as e:
+        if isinstance(e, BrokenProcessPool) and job_executor is executor:
+            logger.error("Job worker died, starting a new one")
+            job_executor = ProcessPoolExecutor(max_workers=1, initializer=init_job_worker)
+            executor.shutdown(wait=False, cancel_futures=True)
+        with SessionLocal() as db:
+            mark_job_failed(db, job_id, f"Job worker failed: {e!r}")
+        return None
+
 # Decorator 
 def require_model_loaded(func):
     @wraps(func)
@@ -60,105 +99,142 @@ def require_model_loaded(func):
         return await func(*args, **kwargs)
     return wrapper
 
+@lru_cache(maxsize=1024)
+def search_titles_cached(recommender, q, limit):
+    return tuple(recommender.search_titles(q, limit))
+
 # Model Initialization 
-def initialize_model(refit_content=False, refit_nmf=False):
+def load_or_train_model(refit_content=False, refit_nmf=False):
     """
-    Load or train the hybrid recommender model.
+    Load the saved model, refitting and saving the requested parts, or train
+    it from scratch. Returns the model without publishing it anywhere.
     """
-    try:
-        if os.path.exists(MODEL_PATH) and not (refit_content or refit_nmf):
-            logger.info("Found existing model, loading...")
-            app.state.recommender = HybridRecommender.load(MODEL_PATH)
-            return
-        else:
-            logger.info("No existing model found — training from scratch...")
-            refit_content = True
-            refit_nmf = True
-        
+    if not os.path.exists(MODEL_PATH) and os.path.exists(LEGACY_MODEL_PATH):
+        logger.info("Migrating pickled model to the directory format...")
+        HybridRecommender.load(LEGACY_MODEL_PATH).save(MODEL_PATH)
+
+    if os.path.exists(MODEL_PATH) and not (refit_content and refit_nmf):
+        logger.info("Found existing model, loading...")
+        recommender = HybridRecommender.load(MODEL_PATH)
+        if not (refit_content or refit_nmf):
+            return recommender
+        # Only part of the model needs refitting, keep the rest of the loaded one
+    else:
+        logger.info("Training model from scratch...")
+        refit_content = True
+        refit_nmf = True
+
         if not os.path.exists(GAMES_OUT) or not os.path.exists(RATINGS_OUT):
-            app.state.GAMES_PATH, app.state.RATINGS_PATH = prepare_steam_data_optimized(
-                games_out=GAMES_OUT, ratings_out=RATINGS_OUT
-            )
+            if os.path.exists(LEGACY_GAMES_OUT) and os.path.exists(LEGACY_RATINGS_OUT):
+                logger.info("Migrating prepared data from .csv.gz to Parquet...")
+                convert_prepared_csv_to_parquet(LEGACY_GAMES_OUT, GAMES_OUT, GAMES_DTYPES)
+                convert_prepared_csv_to_parquet(LEGACY_RATINGS_OUT, RATINGS_OUT, RATINGS_DTYPES)
+                games_path, ratings_path = GAMES_OUT, RATINGS_OUT
+            else:
+                games_path, ratings_path = prepare_steam_data_optimized(
+                    games_out=GAMES_OUT, ratings_out=RATINGS_OUT
+                )
         else:
-            app.state.GAMES_PATH, app.state.RATINGS_PATH = GAMES_OUT, RATINGS_OUT
-        
-        
-        app.state.recommender = HybridRecommender(app.state.GAMES_PATH, app.state.RATINGS_PATH)
+            games_path, ratings_path = GAMES_OUT, RATINGS_OUT
+
+        recommender = HybridRecommender(games_path, ratings_path)
 
-        # Fit models
-        app.state.recommender.fit(refit_content=refit_content, refit_nmf=refit_nmf)
-        app.state.recommender.save(MODEL_PATH)
+    # Fit models in a single pass, then save the fitted model
+    recommender.fit(refit_content=refit_content, refit_nmf=refit_nmf)
+    recommender.save(MODEL_PATH)
+    return recommender
 
+def initialize_model(refit_content=False, refit_nmf=False):
+    """
+    Load or train the hybrid recommender model and publish it to the API.
+    """
+    try:
+        app.state.recommender = load_or_train_model(refit_content, refit_nmf)
     except Exception as e:
         logging.error(f"Failed to initialize model: {e}")
         raise e
 
-# Background Job Handlers
+# Worker Model Cache
+_worker_model = {"mtime": None, "recommender": None}
+
+def get_worker_recommender():
+    """
+    Load the saved model inside the job worker, reusing it until the file changes.
+    """
+    mtime = os.path.getmtime(MODEL_PATH)
+    if _worker_model["recommender"] is None or _worker_model["mtime"] != mtime:
+        _worker_model["recommender"] = HybridRecommender.load(MODEL_PATH)
+        _worker_model["mtime"] = mtime
+    return _worker_model["recommender"]
+
+# Background Job Handlers (run in the job worker process)
 def run_training_job(job_id: int):
-    db_gen = get_db()
-    db = next(db_gen)
-    try:
-        mark_job_running(db, job_id)
-        initialize_model(refit_content=True, refit_nmf=True)
-        mark_job_completed(db, job_id, results={"message": "Model trained successfully"})
-    except Exception as e:
-        mark_job_failed(db, job_id, str(e))
-    finally:
-        db.close()
+    with SessionLocal() as db:
+        try:
+            mark_job_running(db, job_id)
+            # Drop the cached model before training, then keep the trained one as the worker's
+            # cached model instead of loading a second copy for the next evaluation
+            _worker_model["recommender"] = None
+            _worker_model["recommender"] = load_or_train_model(refit_content=True, refit_nmf=True)
+            _worker_model["mtime"] = os.path.getmtime(MODEL_PATH)
+            mark_job_completed(db, job_id, results={"message": "Model trained successfully"})
+            return True
+        except Exception as e:
+            mark_job_failed(db, job_id, str(e))
+            return False
 
 def run_evaluation_job(job_id: int, max_users: int, k: int):
-    db_gen = get_db()
-    db = next(db_gen)
-    try:
-        mark_job_running(db, job_id)
-        evaluator = Evaluator(app.state.recommender)
-        evaluator.fit_recommender()        
-        update_job(db, job_id, progress=10)
-        all_recs = evaluator.generate_all_recommendations(
-            job_id,
-            max_users=max_users,
-            start_progress=10,
-            progress_range=50,
-            progress_step=int(max_users/100)
-        )
-
-        precision_at_k = evaluator.calculate_precision_at_k(all_recs, k=k)
-        update_job_progress(db, job_id, 70)
-        coverage = evaluator.calculate_coverage(all_recs)
-        update_job_progress(db, job_id, 80)
-        novelty = evaluator.calculate_novelty(all_recs)
-        update_job_progress(db, job_id, 90)
-        
-        results = {
-            "users_evaluated": len(all_recs),
-            "precision@k": round(precision_at_k, 4),
-            "coverage": round(coverage, 4),
-            "novelty": round(novelty, 4),
-            "k": k,
-        }
-
-        mark_job_completed(db, job_id, results)
-    except Exception as e:
-        mark_job_failed(db, job_id, str(e))
-    finally:
-        db.close()
+    with SessionLocal() as db:
+        try:
+            mark_job_running(db, job_id)
+            evaluator = Evaluator(get_worker_recommender())
+            evaluator.fit_recommender()        
+            update_job(db, job_id, progress=10)
+            all_recs = evaluator.generate_all_recommendations(
+                job_id,
+                max_users=max_users,
+                start_progress=10,
+                progress_range=50
+            )
+
+            precision_at_k = evaluator.calculate_precision_at_k(all_recs, k=k)
+            update_job_progress(db, job_id, 70)
+            coverage = evaluator.calculate_coverage(all_recs)
+            update_job_progress(db, job_id, 80)
+            novelty = evaluator.calculate_novelty(all_recs)
+            update_job_progress(db, job_id, 90)
+
+            results = {
+                "users_evaluated": len(all_recs),
+                "precision@k": round(precision_at_k, 4),
+                "coverage": round(coverage, 4),
+                "novelty": round(novelty, 4),
+                "k": k,
+            }
+
+            mark_job_completed(db, job_id, results)
+        except Exception as e:
+            mark_job_failed(db, job_id, str(e))
+
+async def train_and_reload(job_id: int):
+    if await run_in_job_executor(run_training_job, job_id):
+        # The worker saved the new model, pick it up in the API process
+        app.state.recommender = await asyncio.to_thread(HybridRecommender.load, MODEL_PATH)
+        search_titles_cached.cache_clear()
 
 # Startup
 @app.on_event("startup")
 async def startup_event():
     app.state.recommender = None
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=API_THREAD_WORKERS))
     
     # Fix any orphaned jobs in the database
-    db_gen = get_db()
-    db = next(db_gen)
-    try:
+    with SessionLocal() as db:
         orphaned_jobs = db.query(Job).filter(Job.status.in_([JobStatus.RUNNING, JobStatus.PENDING])).all()
         for job in orphaned_jobs:
             job.status = JobStatus.FAILED
             job.error_message = "App crashed or restarted while this job was running"
         db.commit()
-    finally:
-        db.close()
     
     asyncio.create_task(asyncio.to_thread(initialize_model))
     logging.info("FastAPI started and initializing model...")
@@ -166,24 +242,34 @@ async def startup_event():
 @app.on_event("shutdown")
 def shutdown_event_handler():
     logging.info("Shutting down FastAPI...")
+    job_executor.shutdown(wait=False, cancel_futures=True)
 
 # API Endpoints
 @app.post("/train")
 async def train_model(background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    # Check-then-create has no await in between, so it is atomic within this event loop.
+    # It does not guard against several uvicorn worker processes.
+    active_training = (
+        db.query(Job)
+        .filter(Job.type == JobType.TRAINING, Job.status.in_([JobStatus.RUNNING, JobStatus.PENDING]))
+        .first()
+    )
+    if active_training:
+        raise HTTPException(status_code=409, detail=f"Training job {active_training.id} is already in progress")
     job = create_job(db, JobType.TRAINING)
-    background_tasks.add_task(run_training_job, job.id)
+    background_tasks.add_task(train_and_reload, job.id)
     return {"job_id": job.id, "status": "queued"}
 
 @app.post("/evaluate")
 @require_model_loaded
 async def evaluate_model(background_tasks: BackgroundTasks, max_users: int = 30000, k: int = 10, db: Session = Depends(get_db)):
     job = create_job(db, JobType.EVALUATION, params={"max_users": max_users, "k": k})
-    background_tasks.add_task(run_evaluation_job, job.id, max_users, k)
+    background_tasks.add_task(run_in_job_executor, run_evaluation_job, job.id, max_users, k)
     return {"job_id": job.id, "status": "queued"}
 
 @app.get("/jobs/{job_id}")
 def get_job_status(job_id: int, db: Session = Depends(get_db)):
-    job = db.query(Job).get(job_id)
+    job = db.get(Job, job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     return job
@@ -232,9 +318,10 @@ def get_model_status(db: Session = Depends(get_db)):
 @app.get("/games/search")
 @require_model_loaded
 async def search_games(q: str = Query(None, description="Search query for game title"), limit: int = Query(10, ge=1, le=10)):
-    matches = app.state.recommender.games_df["title"].str.contains(q, case=False, na=False)
-    titles = app.state.recommender.games_df.loc[matches, "title"].head(limit).tolist()
-    return {"games": titles}
+    if not q:
+        return {"games": []}
+    titles = search_titles_cached(app.state.recommender, q.lower(), limit)
+    return {"games": list(titles)}
 
 @app.get("/recommend")
 @require_model_loaded
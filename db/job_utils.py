@@ -1,4 +1,4 @@
-from datetime import datetime, timezone
+from sqlalchemy import func, update
 from sqlalchemy.orm import Session
 from .models import Job, JobStatus
 
@@ -10,13 +10,18 @@ def create_job(db: Session, job_type, params=None):
     return job
 
 def update_job_progress(db, job_id, progress):
-    job = db.query(Job).get(job_id)
+    job = db.get(Job, job_id)
     if job:
         job.progress = min(progress, 100)
         db.commit()
 
+def update_job_progress_fast(db: Session, job_id, progress):
+    """Single UPDATE without loading the job first, for progress reporting in hot loops."""
+    db.execute(update(Job).where(Job.id == job_id).values(progress=min(progress, 100)))
+    db.commit()
+
 def update_job(db: Session, job_id, **kwargs):
-    job = db.query(Job).get(job_id)
+    job = db.get(Job, job_id)
     if not job:
         return None
     for key, value in kwargs.items():
@@ -29,14 +34,14 @@ def mark_job_running(db: Session, job_id):
     return update_job(
         db, job_id,
         status=JobStatus.RUNNING,
-        started_at=datetime.now(timezone.utc)
+        started_at=func.now()
     )
     
 def mark_job_completed(db: Session, job_id, results=None):
     return update_job(
         db, job_id,
         status=JobStatus.COMPLETED,
-        finished_at=datetime.now(timezone.utc),
+        finished_at=func.now(),
         progress=100,
         results=results
     )
@@ -45,11 +50,12 @@ def mark_job_failed(db: Session, job_id, error_message):
     return update_job(
         db, job_id,
         status=JobStatus.FAILED,
-        finished_at=datetime.now(timezone.utc),
+        finished_at=func.now(),
         error_message=str(error_message),
         progress=0
     )
     
 
 def list_jobs(db: Session):
-    return db.query(Job).order_by(Job.created_at.desc()).all()
\ No newline at end of file
+    # SQLite's CURRENT_TIMESTAMP has second resolution, break ties by id
+    return db.query(Job).order_by(Job.created_at.desc(), Job.id.desc()).all()
\ No newline at end of file
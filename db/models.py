@@ -1,7 +1,6 @@
 from sqlalchemy import (
-    Column, Integer, Enum, JSON, String, DateTime
+    Column, Integer, Enum, JSON, String, DateTime, Index, func
 )
-from datetime import datetime, timezone
 import enum
 from .database import Base
 
@@ -17,6 +16,9 @@ class JobStatus(enum.Enum):
 
 class Job(Base):
     __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_status_type", "status", "type"),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     type = Column(Enum(JobType), nullable=False)
     status = Column(Enum(JobStatus), default=JobStatus.PENDING, nullable=False)
@@ -24,6 +26,15 @@ class Job(Base):
     params = Column(JSON, nullable=True)
     results = Column(JSON, nullable=True)
     error_message = Column(String, nullable=True)
-    created_at = Column(DateTime, default=datetime.now(timezone.utc))
-    started_at = Column(DateTime, nullable=True)
-    finished_at = Column(DateTime, nullable=True)
\ No newline at end of file
+    # default renders now() in the INSERT too, for tables created before server_default existed
+    created_at = Column(DateTime(timezone=True), default=func.now(), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+# Partial index for the active (pending/running) job lookups
+Index(
+    "ix_jobs_active",
+    Job.type,
+    sqlite_where=Job.status.in_([JobStatus.PENDING, JobStatus.RUNNING]),
+    postgresql_where=Job.status.in_([JobStatus.PENDING, JobStatus.RUNNING]),
+)
\ No newline at end of file
@@ -1,8 +1,41 @@
 import pandas as pd
 import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
+from numba import njit, prange
 from db.database import SessionLocal
 from db.models import Job
-from db.job_utils import update_job_progress
+from db.job_utils import update_job_progress_fast
+
+@njit(parallel=True, cache=True)
+def _count_hits(rec_matrix, user_rows, liked_flat, liked_indptr):
+    """Count recommended indices found in each user's sorted liked indices (CSR layout, row -1 = none)."""
+    hits = np.zeros(rec_matrix.shape[0], dtype=np.int32)
+    for i in prange(rec_matrix.shape[0]):
+        r = user_rows[i]
+        if r < 0:
+            continue
+        row = liked_flat[liked_indptr[r]:liked_indptr[r + 1]]
+        count = 0
+        for j in range(rec_matrix.shape[1]):
+            g = rec_matrix[i, j]
+            if g >= 0:
+                pos = np.searchsorted(row, g)
+                if pos < len(row) and row[pos] == g:
+                    count += 1
+        hits[i] = count
+    return hits
+
+@njit(parallel=True, cache=True)
+def _novelty_sum(codes, pop_by_code):
+    """Sum of -log2(popularity) and count over codes with known, non-zero popularity."""
+    total = 0.0
+    count = 0
+    for i in prange(len(codes)):
+        c = codes[i]
+        if c >= 0 and pop_by_code[c] > 0:
+            total += -np.log2(pop_by_code[c])
+            count += 1
+    return total, count
 
 class Evaluator:
     @staticmethod
@@ -21,19 +54,47 @@ class Evaluator:
         self.gameid_to_title = None
 
     def fit_recommender(self):
-        """Precompute popularity and mapping dictionaries."""
-        rating_counts = self.ratings_df["gameId"].value_counts()
-        num_users = self.ratings_df["userId"].nunique()
-        self.popularity_scores = (rating_counts / num_users).to_dict()
-
-        games_unique = self.games_df.drop_duplicates(subset="title")
-        self.title_to_id = pd.Series(games_unique.gameId.values, index=games_unique.title).to_dict()
-        self.gameid_to_title = pd.Series(games_unique.title.values, index=games_unique.gameId).to_dict()
-        self.popularity_series = pd.Series(self.popularity_scores)
+        """Bind the recommender's cached lookup tables and precompute evaluation arrays."""
+        self.popularity_scores = self.recommender.popularity_scores
+        self.title_to_id = self.recommender.title_to_id
+        self.gameid_to_title = self.recommender.gameid_to_title
+        self.n_unique_titles = int(self.games_df["title"].nunique())
+
+        # For novelty: popularity indexed by dense title code
+        self.title_codes = pd.Index(list(self.title_to_id))
+        self.pop_by_code = np.fromiter(
+            (self.popularity_scores.get(gid, 0.0) for gid in self.title_to_id.values()),
+            dtype=np.float64,
+            count=len(self.title_to_id),
+        )
+
+        # For seed game selection
+        self.game_titles = self.games_df["title"].to_numpy()
+        self.game_titles_by_id = dict(zip(self.games_df["gameId"], self.games_df["title"]))
+        self.liked_users, self.liked_indptr, self.liked_flat = self.recommender.liked_games
 
         # For Precision@k vectorization
         self.all_game_ids = np.array(list(self.gameid_to_title.keys()))
-        self.gameid_to_idx = {gid: idx for idx, gid in enumerate(self.all_game_ids)}
+        self.gameid_index = pd.Index(self.all_game_ids)
+        # Ordered like all_game_ids, so a title's category code is its game index
+        self.title_categories = pd.Index(list(self.gameid_to_title.values()))
+
+        # Liked game indices per liked user, sorted within each row, reused by every Precision@k call
+        game_idx = self.gameid_index.get_indexer(self.liked_flat)
+        user_row = np.repeat(np.arange(len(self.liked_users)), np.diff(self.liked_indptr))
+        known = game_idx >= 0
+        game_idx, user_row = game_idx[known], user_row[known]
+        order = np.lexsort((game_idx, user_row))
+        self.liked_idx_flat = game_idx[order].astype(np.int64)
+        self.liked_idx_indptr = np.zeros(len(self.liked_users) + 1, dtype=np.int64)
+        self.liked_idx_indptr[1:] = np.cumsum(np.bincount(user_row, minlength=len(self.liked_users)))
+
+    def _liked_rows(self, user_ids):
+        """Row of each user in the liked-games CSR arrays, -1 for users without liked games."""
+        if not len(self.liked_users):
+            return np.full(len(user_ids), -1, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.liked_users, user_ids), len(self.liked_users) - 1)
+        return np.where(self.liked_users[rows] == user_ids, rows, -1)
 
     def generate_all_recommendations(
         self, 
@@ -43,7 +104,8 @@ class Evaluator:
         n: int = 10,
         start_progress: int = 0,
         progress_range: int = 100,
-        progress_step: int = 50
+        progress_step: int | None = None,
+        n_jobs: int = -1
     ):
         """Generate recommendations for a sample of users with multiple seed games."""
         rng = np.random.default_rng(random_state)
@@ -51,76 +113,76 @@ class Evaluator:
 
         unique_users = self.ratings_df["userId"].unique()
         user_sample = rng.choice(unique_users, size=min(max_users, len(unique_users)), replace=False)
-
-        db = SessionLocal()
-        try:
-            for i, user_id in enumerate(user_sample, start=1):
-                # Choose a seed game
-                user_games = self.ratings_df[
-                    (self.ratings_df["userId"] == user_id) & (self.ratings_df["rating"] >= 2.5)
-                ]
-                if not user_games.empty:
-                    seed_game_id = user_games.sample(1, random_state=rng.integers(1e6))["gameId"].iloc[0]
-                    seed_game = self.games_df.loc[self.games_df["gameId"] == seed_game_id, "title"].iloc[0]
-                else:
-                    seed_game = self.games_df.sample(1, random_state=rng.integers(1e6))["title"].iloc[0]
-
-                recs = self.recommender.recommend(user_id, seed_game, n)
-                all_recommendations[user_id] = recs if recs else []
-
-                # Update progress
-                if job_id and (i % progress_step == 0 or i == len(user_sample)):
-                    progress_percent = start_progress + int((i / len(user_sample)) * progress_range)
-                    update_job_progress(db, job_id, progress_percent)
-        finally:
-            db.close()
+        if not progress_step:
+            # Report at most ~20 times (every 5% of the sample)
+            progress_step = max(1, len(user_sample) // 20)
+
+        # Choose seed games for all sampled users at once
+        seed_games = self.game_titles[rng.integers(len(self.game_titles), size=len(user_sample))]
+        rows = self._liked_rows(user_sample)
+        has_liked = rows >= 0
+        starts = self.liked_indptr[rows[has_liked]]
+        counts = self.liked_indptr[rows[has_liked] + 1] - starts
+        seed_ids = self.liked_flat[starts + rng.integers(counts)]
+        seed_games[has_liked] = [self.game_titles_by_id[gid] for gid in seed_ids]
+
+        # Recommend in batches of progress_step users, reporting progress after each batch.
+        # Each batch is split across threads; the model is read-only and the heavy work is in
+        # NumPy/SciPy code that releases the GIL.
+        with Parallel(n_jobs=n_jobs, prefer="threads") as parallel:
+            for start in range(0, len(user_sample), progress_step):
+                users = user_sample[start:start + progress_step]
+                seeds = seed_games[start:start + progress_step]
+                chunks = [c for c in np.array_split(np.arange(len(users)), effective_n_jobs(n_jobs)) if len(c)]
+                chunk_recs = parallel(
+                    delayed(self.recommender.recommend_batch)(users[c], seeds[c], n) for c in chunks
+                )
+                for user_id, recs in zip(users, (recs for part in chunk_recs for recs in part)):
+                    all_recommendations[user_id] = recs if recs else []
+
+                # Update progress with a short-lived session
+                if job_id:
+                    done = start + len(users)
+                    progress_percent = start_progress + int((done / len(user_sample)) * progress_range)
+                    with SessionLocal() as db:
+                        update_job_progress_fast(db, job_id, progress_percent)
 
         return all_recommendations
 
     def calculate_precision_at_k(self, all_recommendations, k=10):
-        """Fully vectorized Precision@k using boolean arrays."""
+        """Precision@k with a JIT-compiled hit count over sorted liked indices."""
         if not all_recommendations:
             return 0.0
 
         user_ids = np.array(list(all_recommendations.keys()))
         num_users = len(user_ids)
-        num_games = len(self.all_game_ids)
-
-        # Build liked boolean matrix (num_users x num_games)
-        liked_matrix = np.zeros((num_users, num_games), dtype=bool)
-        user_id_to_idx = {uid: idx for idx, uid in enumerate(user_ids)}
-
-        for uid, games in self.ratings_df[self.ratings_df["rating"] >= 2.5].groupby("userId")["gameId"]:
-            if uid in user_id_to_idx:
-                idx = user_id_to_idx[uid]
-                liked_indices = [self.gameid_to_idx[g] for g in games if g in self.gameid_to_idx]
-                liked_matrix[idx, liked_indices] = True
 
-        # Build recommendation indices
-        rec_matrix = np.zeros((num_users, k), dtype=int)
+        # Build recommendation indices in one categorical encoding, -1 marks unknown titles and padding
+        flat_recs = [None] * (num_users * k)
         for i, uid in enumerate(user_ids):
             recs = all_recommendations[uid][:k]
-            rec_matrix[i, :len(recs)] = [self.gameid_to_idx.get(self.title_to_id.get(title, -1), -1) for title in recs]
+            flat_recs[i * k:i * k + len(recs)] = recs
+        codes = pd.Categorical(flat_recs, categories=self.title_categories).codes
+        rec_matrix = codes.astype(np.int64).reshape(num_users, k)
 
-        # Calculate hits
-        hits = []
-        for i in range(num_users):
-            valid_indices = rec_matrix[i] >= 0
-            if valid_indices.any():
-                hits.append(liked_matrix[i, rec_matrix[i, valid_indices]].sum())
+        # Calculate hits for users with at least one known recommendation
+        hits = _count_hits(rec_matrix, self._liked_rows(user_ids), self.liked_idx_flat, self.liked_idx_indptr)
+        has_recs = (rec_matrix >= 0).any(axis=1)
 
-        return self.safe_mean(np.array(hits) / k)
+        return self.safe_mean(hits[has_recs] / k)
 
     def calculate_coverage(self, all_recommendations):
         """Fraction of unique games recommended."""
         if not all_recommendations:
             return 0.0
 
-        all_titles = np.unique([title for recs in all_recommendations.values() for title in recs])
-        return len(all_titles) / max(1, self.games_df["title"].nunique())
+        unique_titles = set()
+        for recs in all_recommendations.values():
+            unique_titles.update(recs)
+        return len(unique_titles) / max(1, self.n_unique_titles)
 
     def calculate_novelty(self, all_recommendations):
-        """Vectorized novelty: mean -log2(popularity)."""
+        """Novelty: mean -log2(popularity) over recommended titles."""
         if self.popularity_scores is None or self.title_to_id is None:
             raise ValueError("Call fit_recommender() first.")
 
@@ -128,10 +190,9 @@ class Evaluator:
         if not titles:
             return 0.0
 
-        # map titles -> gameId -> popularity using vectorized pandas
-        game_ids = pd.Series(titles).map(self.title_to_id)
-        popularity = game_ids.map(self.popularity_series).fillna(0.0)
-        mask = popularity > 0
-        if mask.any():
-            return float((-np.log2(popularity[mask])).mean())
+        # map titles -> dense code in one hash pass, then reduce in a JIT-compiled kernel
+        codes = self.title_codes.get_indexer(titles).astype(np.int64)
+        total, count = _novelty_sum(codes, self.pop_by_code)
+        if count:
+            return float(total / count)
         return 0.0
@@ -1,12 +1,17 @@
 import pandas as pd
 import numpy as np
-from scipy.sparse import csr_matrix
-from sklearn.decomposition import NMF
+from scipy.sparse import csr_matrix, load_npz, save_npz
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from implicit.als import AlternatingLeastSquares
 import joblib
+from functools import cached_property
+from itertools import islice
 from pathlib import Path
 import logging
+import os
+import shutil
+import time
+from .prepare_data import GAMES_DTYPES, RATINGS_DTYPES
 from sklearnex import patch_sklearn
 patch_sklearn(verbose=False)
 
@@ -21,129 +26,387 @@ logging.getLogger("sklearnex").setLevel(logging.WARNING)
 class HybridRecommender:
     def __init__(self, game_data_path, rating_data_path):
         logger.info("Initializing HybridRecommender...")
-        self.games_df = pd.read_csv(game_data_path)
-        self.ratings_df = pd.read_csv(rating_data_path)
+        self.games_df = pd.read_parquet(game_data_path, columns=list(GAMES_DTYPES)).astype(GAMES_DTYPES)
+        self.ratings_df = pd.read_parquet(rating_data_path, columns=list(RATINGS_DTYPES)).astype(RATINGS_DTYPES)
         logger.info(f"Loaded {len(self.games_df)} games and {len(self.ratings_df)} ratings.")
         self.content_recommender = self._ContentBasedRecommender(self.games_df)
-        self.nmf_model = None
+        self.cf_model = None
+        self.user_factors = None
+        self.item_factors = None
         self.user_item_matrix = None
         self.user_mapper = None
         self.game_mapper = None
         self.game_inv_mapper = None
 
     def fit(self, refit_content=True, refit_nmf=True, n_components=20):
+        self.clear_cached_tables()
         if refit_content:
             logger.info("Fitting content-based recommender (TF-IDF)...")
             self.content_recommender.fit()
             logger.info(f"TF-IDF matrix shape: {self.content_recommender.tfidf_matrix.shape}")
 
         if refit_nmf:
-            logger.info("Preparing user-item matrix for NMF collaborative filtering...")
-            user_ids = self.ratings_df["userId"].unique()
-            game_ids = self.ratings_df["gameId"].unique()
-            self.user_mapper = {uid: i for i, uid in enumerate(user_ids)}
-            self.game_mapper = {gid: i for i, gid in enumerate(game_ids)}
-            self.game_inv_mapper = {i: gid for gid, i in self.game_mapper.items()}
+            logger.info("Preparing user-item matrix for ALS collaborative filtering...")
+            # Integer codes in order of first appearance, same order as unique()
+            user_index, user_ids = pd.factorize(self.ratings_df["userId"], sort=False)
+            game_index, game_ids = pd.factorize(self.ratings_df["gameId"], sort=False)
+            self.user_mapper = dict(zip(user_ids, range(len(user_ids))))
+            self.game_mapper = dict(zip(game_ids, range(len(game_ids))))
+            self.game_inv_mapper = dict(zip(range(len(game_ids)), game_ids))
 
-            user_index = self.ratings_df["userId"].map(self.user_mapper)
-            game_index = self.ratings_df["gameId"].map(self.game_mapper)
-            ratings = self.ratings_df["rating"].astype(np.float32)  # save memory
+            ratings = self.ratings_df["rating"].to_numpy(np.float32)  # save memory
 
+            # int32 indices and float32 values: half the memory traffic of the scipy defaults
             self.user_item_matrix = csr_matrix(
-                (ratings, (user_index, game_index)),
-                shape=(len(user_ids), len(game_ids))
+                (ratings, (user_index.astype(np.int32), game_index.astype(np.int32))),
+                shape=(len(user_ids), len(game_ids)),
+                dtype=np.float32,
             )
             logger.info(f"User-item matrix shape: {self.user_item_matrix.shape}")
 
-            logger.info(f"Fitting NMF model with {n_components} components...")
-            self.nmf_model = NMF(
-                n_components=n_components,
-                init="random",
+            logger.info(f"Fitting ALS model with {n_components} factors...")
+            # Ratings are implicit feedback, ALS works on the sparse matrix directly and is multithreaded
+            self.cf_model = AlternatingLeastSquares(
+                factors=n_components,
+                iterations=15,
+                use_gpu=False,
                 random_state=42,
-                max_iter=400,
             )
-            self.nmf_model.fit(self.user_item_matrix)
-            logger.info("NMF model fitted successfully.")
+            self.cf_model.fit(self.user_item_matrix, show_progress=False)
+            # Same layout as before: users x factors and factors x games
+            self.user_factors = self.cf_model.user_factors
+            self.item_factors = self.cf_model.item_factors.T
+            logger.info("ALS model fitted successfully.")
 
     def recommend(self, user_id, seed_title, n=10):
         logger.debug(f"Generating recommendations for user {user_id} with seed '{seed_title}'")
-        content_recs = self.content_recommender.recommend(seed_title, n)
+        # One similarity pass gives both the top-n content recs and the CF candidates
+        neighbors = self.content_recommender.similar_rows([seed_title], max(n, self.CF_CANDIDATES))
+        content_recs = self.content_recommender.row_titles(neighbors[0][:n])
         collaborative_recs = []
 
-        if self.nmf_model is not None and user_id in self.user_mapper:
+        if self.user_factors is not None and user_id in self.user_mapper:
             user_idx = self.user_mapper[user_id]
-            user_vector = self.user_item_matrix[user_idx]
-            user_P = self.nmf_model.transform(user_vector)
-            item_Q = self.nmf_model.components_
-            scores = user_P @ item_Q
-            scores_series = pd.Series(scores.flatten(), index=list(self.game_mapper.keys()))
-
-            rated_games = self.ratings_df[self.ratings_df["userId"] == user_id]["gameId"]
-            scores_series = scores_series.drop(index=rated_games, errors="ignore")
-
-            top_game_ids = scores_series.nlargest(n).index.tolist()
-            collaborative_recs = self.games_df[self.games_df["gameId"].isin(top_game_ids)]["title"].tolist()
+            candidates = self._candidate_columns(neighbors)
+            collaborative_recs = self._collaborative_batch(np.array([user_idx]), candidates, n)[0]
 
         combined = list(dict.fromkeys(content_recs + collaborative_recs))
         logger.debug(f"Returning {len(combined[:n])} combined recommendations")
         return combined[:n]
 
-    def save(self, path="models/recommender.pkl"):
-        Path(path).parent.mkdir(exist_ok=True, parents=True)
-        joblib.dump({
-            "nmf_model": self.nmf_model,
-            "user_mapper": self.user_mapper,
-            "game_mapper": self.game_mapper,
-            "game_inv_mapper": self.game_inv_mapper,
-            "user_item_matrix": self.user_item_matrix,
-            "tfidf_matrix": self.content_recommender.tfidf_matrix,
-            "game_indices": self.content_recommender.game_indices,
-            "games_df": self.games_df,
-            "ratings_df": self.ratings_df
-        }, path)
-        logger.info(f"Recommender saved to {path}")
+    def recommend_batch(self, user_ids, seed_titles, n=10):
+        """Recommend for many (user, seed title) pairs, scoring collaborative filtering in one batch."""
+        # One similarity pass per seed gives both the top-n content recs and the CF candidates
+        neighbors = self.content_recommender.similar_rows(seed_titles, max(n, self.CF_CANDIDATES))
+        combined = [list(dict.fromkeys(self.content_recommender.row_titles(rows[:n]))) for rows in neighbors]
+
+        # Collaborative recs only change the result for users whose content recs fill fewer than n slots
+        if self.user_factors is not None:
+            batch = [
+                (pos, self.user_mapper[user_id])
+                for pos, user_id in enumerate(user_ids)
+                if len(combined[pos]) < n and user_id in self.user_mapper
+            ]
+            if batch:
+                positions, user_idx = zip(*batch)
+                candidates = self._candidate_columns([neighbors[pos] for pos in positions])
+                for pos, collaborative_recs in zip(positions, self._collaborative_batch(np.array(user_idx), candidates, n)):
+                    combined[pos] = list(dict.fromkeys(combined[pos] + collaborative_recs))
+
+        return [recs[:n] for recs in combined]
+
+    # Collaborative filtering only scores this many most-rated games plus as many content neighbours of the seed
+    CF_CANDIDATES = 500
+
+    def _candidate_columns(self, neighbors):
+        """User-item matrix columns to score per seed: the most-rated games and the seed's content neighbours."""
+        columns = (self._row_columns[rows[:self.CF_CANDIDATES]] for rows in neighbors)
+        return [np.union1d(self._popular_columns, cols[cols >= 0]) for cols in columns]
+
+    def _collaborative_batch(self, user_idx, candidates, n, chunk_size=256):
+        """Top-n unrated titles per user, scored in chunks of users to bound the gathered factors."""
+        recs = []
+        for start in range(0, len(user_idx), chunk_size):
+            recs.extend(self._collaborative_chunk(
+                user_idx[start:start + chunk_size], candidates[start:start + chunk_size], n
+            ))
+        return recs
+
+    def _collaborative_chunk(self, user_idx, candidates, n):
+        """Top-n unrated titles per user among its own candidate columns: ALS scores, rated games masked, argpartition."""
+        # Pad each user's sorted candidates to a common width with a sentinel past the last column
+        n_columns = self.user_item_matrix.shape[1]
+        width = max(len(cand) for cand in candidates)
+        columns = np.full((len(user_idx), width), n_columns, dtype=np.int64)
+        for i, cand in enumerate(candidates):
+            columns[i, :len(cand)] = cand
+
+        # Each user is scored only against its own candidates' item vectors, in float32
+        user_vectors = self.user_factors[user_idx].astype(np.float32, copy=False)
+        item_vectors = self._item_vectors[np.minimum(columns, n_columns - 1)]
+        scores = np.einsum("uk,uck->uc", user_vectors, item_vectors)
+        scores[columns == n_columns] = -np.inf
+
+        # Exclude games the users already rated. Rows are sorted and padded with the sentinel,
+        # so row-offset keys are sorted across the whole chunk and one searchsorted finds them all.
+        rated_rows = self.user_item_matrix[user_idx]
+        rows = np.repeat(np.arange(len(user_idx)), np.diff(rated_rows.indptr))
+        keys = (np.arange(len(user_idx))[:, None] * (n_columns + 1) + columns).ravel()
+        rated_keys = rows * (n_columns + 1) + rated_rows.indices
+        pos = np.minimum(np.searchsorted(keys, rated_keys), len(keys) - 1)
+        scores.ravel()[pos[keys[pos] == rated_keys]] = -np.inf
+
+        n_top = min(n, scores.shape[1])
+        top = np.argpartition(-scores, n_top - 1, axis=1)[:, :n_top]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        top_columns = np.take_along_axis(columns, top, axis=1)
+
+        return [
+            [title for title in self._cf_titles[row[np.isfinite(row_scores)]] if title is not None]
+            for row, row_scores in zip(top_columns, top_scores)
+        ]
+
+    # Derived lookup tables, computed on first use and cached per instance
+    _CACHED_TABLES = (
+        "popularity_scores",
+        "title_to_id",
+        "gameid_to_title",
+        "liked_games",
+        "_title_search_index",
+        "_cf_titles",
+        "_game_keys",
+        "_id_to_title",
+        "_popular_columns",
+        "_row_columns",
+        "_item_vectors",
+    )
+
+    def clear_cached_tables(self):
+        for name in self._CACHED_TABLES:
+            self.__dict__.pop(name, None)
+
+    @cached_property
+    def popularity_scores(self):
+        """gameId -> share of users who rated the game."""
+        rating_counts = self.ratings_df["gameId"].value_counts()
+        num_users = self.ratings_df["userId"].nunique()
+        return (rating_counts / num_users).to_dict()
+
+    @cached_property
+    def title_to_id(self):
+        games_unique = self.games_df.drop_duplicates(subset="title")
+        return pd.Series(games_unique.gameId.values, index=games_unique.title).to_dict()
+
+    @cached_property
+    def gameid_to_title(self):
+        games_unique = self.games_df.drop_duplicates(subset="title")
+        return pd.Series(games_unique.title.values, index=games_unique.gameId).to_dict()
+
+    @cached_property
+    def liked_games(self):
+        """Games rated >= 2.5 per user as CSR-style (users, indptr, gameIds) arrays."""
+        liked = self.ratings_df[self.ratings_df["rating"] >= 2.5].sort_values("userId", kind="stable")
+        users, counts = np.unique(liked["userId"].to_numpy(), return_counts=True)
+        indptr = np.zeros(len(users) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(counts)
+        return users, indptr, liked["gameId"].to_numpy()
+
+    @cached_property
+    def _game_keys(self):
+        """gameId per user-item matrix column."""
+        return np.array(list(self.game_mapper.keys()))
+
+    @cached_property
+    def _id_to_title(self):
+        return dict(zip(self.games_df["gameId"], self.games_df["title"]))
+
+    @cached_property
+    def _cf_titles(self):
+        """Title per user-item matrix column, None for games missing from games_df."""
+        return np.array([self._id_to_title.get(gid) for gid in self._game_keys], dtype=object)
+
+    @cached_property
+    def _popular_columns(self):
+        """User-item matrix columns of the CF_CANDIDATES most-rated games."""
+        counts = np.bincount(self.user_item_matrix.indices, minlength=self.user_item_matrix.shape[1])
+        return np.sort(np.argsort(-counts, kind="stable")[:self.CF_CANDIDATES])
+
+    @cached_property
+    def _row_columns(self):
+        """User-item matrix column per games_df row, -1 for games nobody rated."""
+        return pd.Index(self._game_keys).get_indexer(self.games_df["gameId"])
+
+    @cached_property
+    def _item_vectors(self):
+        """Item factors as contiguous float32 rows, one per user-item matrix column."""
+        return np.ascontiguousarray(self.item_factors.T, dtype=np.float32)
+
+    @cached_property
+    def _title_search_index(self):
+        titles = self.games_df["title"].dropna().astype(str).tolist()
+        return titles, [title.lower() for title in titles]
+
+    def search_titles(self, query, limit=10):
+        """Case-insensitive substring search over game titles."""
+        titles, titles_lower = self._title_search_index
+        query = query.lower()
+        matches = (title for title, lower in zip(titles, titles_lower) if query in lower)
+        return list(islice(matches, limit))
+
+    def save(self, path="models/recommender"):
+        """
+        Save as a directory of sparse .npz, .npy and Parquet files, so loading
+        needs no unpickling and the factor matrices can be memory-mapped.
+
+        Every save writes a new version subdirectory and then atomically points
+        CURRENT at it, so files another process has memory-mapped are never
+        overwritten in place.
+        """
+        path = Path(path)
+        path.mkdir(exist_ok=True, parents=True)
+        version = path / f"v{time.time_ns()}"
+        version.mkdir()
+        self.games_df.to_parquet(version / "games.parquet", index=False)
+        self.ratings_df.to_parquet(version / "ratings.parquet", index=False)
+        save_npz(version / "tfidf_matrix.npz", self.content_recommender.tfidf_matrix)
+        save_npz(version / "user_item_matrix.npz", self.user_item_matrix)
+        np.save(version / "user_factors.npy", self.user_factors)
+        np.save(version / "item_factors.npy", self.item_factors)
+        np.save(version / "user_ids.npy", np.array(list(self.user_mapper)))
+        np.save(version / "game_ids.npy", np.array(list(self.game_mapper)))
+
+        pointer = path / "CURRENT.tmp"
+        pointer.write_text(version.name)
+        os.replace(pointer, path / "CURRENT")
+
+        # Old versions may still be mapped by a loaded model; unlinking them is safe on POSIX,
+        # on Windows they can't be deleted yet and are retried on the next save
+        for old in path.glob("v*"):
+            if old != version:
+                shutil.rmtree(old, ignore_errors=True)
+        # Bump the directory mtime so loaders see a new model
+        os.utime(path)
+        logger.info(f"Recommender saved to {version}")
 
     @classmethod
     def load(cls, path):
+        path = Path(path)
+        if path.is_file():
+            return cls._load_pickle(path)
+
+        path = path / (path / "CURRENT").read_text().strip()
+
         logger.info(f"Loading recommender from {path}")
+        obj = cls.__new__(cls)
+        obj.cf_model = None
+        obj.games_df = pd.read_parquet(path / "games.parquet")
+        obj.ratings_df = pd.read_parquet(path / "ratings.parquet")
+        obj.user_item_matrix = load_npz(path / "user_item_matrix.npz")
+        obj.user_factors = np.load(path / "user_factors.npy", mmap_mode="r")
+        obj.item_factors = np.load(path / "item_factors.npy", mmap_mode="r")
+        user_ids = np.load(path / "user_ids.npy")
+        game_ids = np.load(path / "game_ids.npy")
+        obj.user_mapper = dict(zip(user_ids, range(len(user_ids))))
+        obj.game_mapper = dict(zip(game_ids, range(len(game_ids))))
+        obj.game_inv_mapper = dict(zip(range(len(game_ids)), game_ids))
+        obj.content_recommender = cls._ContentBasedRecommender(obj.games_df)
+        obj.content_recommender.tfidf_matrix = load_npz(path / "tfidf_matrix.npz")
+        obj.content_recommender.build_index()
+        logger.info("Recommender loaded successfully")
+        return obj
+
+    @classmethod
+    def _load_pickle(cls, path):
+        """Load a model saved as a single joblib pickle by earlier versions."""
+        logger.info(f"Loading pickled recommender from {path}")
         data = joblib.load(path)
         obj = cls.__new__(cls)
-        obj.nmf_model = data["nmf_model"]
+        # Pickled models were fitted with sklearn NMF
+        obj.cf_model = data["nmf_model"]
         obj.user_mapper = data["user_mapper"]
         obj.game_mapper = data["game_mapper"]
         obj.game_inv_mapper = data["game_inv_mapper"]
         obj.user_item_matrix = data["user_item_matrix"]
+        obj.user_factors = data.get("user_factors")
+        if obj.user_factors is None and obj.cf_model is not None:
+            # Models saved before user factors were stored
+            obj.user_factors = obj.cf_model.transform(obj.user_item_matrix)
+        obj.item_factors = obj.cf_model.components_ if obj.cf_model is not None else None
+        # Older models were fitted in float64, downcast to match freshly fitted ones
+        obj.user_item_matrix = obj.user_item_matrix.astype(np.float32)
+        if obj.user_factors is not None:
+            obj.user_factors = obj.user_factors.astype(np.float32)
+            obj.item_factors = obj.item_factors.astype(np.float32)
         obj.games_df = data["games_df"]
         obj.ratings_df = data["ratings_df"]
         obj.content_recommender = cls._ContentBasedRecommender(obj.games_df)
-        obj.content_recommender.tfidf_matrix = data["tfidf_matrix"]
-        obj.content_recommender.game_indices = data["game_indices"]
+        obj.content_recommender.tfidf_matrix = data["tfidf_matrix"].astype(np.float32)
+        obj.content_recommender.build_index()
         logger.info("Recommender loaded successfully")
         return obj
 
     class _ContentBasedRecommender:
         def __init__(self, games_df):
-            self.games_df = games_df.copy()
+            # Only titles and TF-IDF input are needed, as arrays indexed by row position
+            self._titles = games_df["title"].to_numpy()
+            self._genres = games_df["genres"].fillna("").to_numpy()
 
         def fit(self):
-            self.games_df = self.games_df.reset_index(drop=True)
-            self.games_df["genres"] = self.games_df["genres"].fillna("")
-            tfidf = TfidfVectorizer(stop_words="english")
-            self.tfidf_matrix = tfidf.fit_transform(self.games_df["genres"])
-            self.game_indices = pd.Series(self.games_df.index, index=self.games_df["title"]).drop_duplicates()
+            # float32 and a capped vocabulary keep the matrix every similarity lookup multiplies against small
+            tfidf = TfidfVectorizer(
+                stop_words="english",
+                dtype=np.float32,
+                max_features=50_000,
+                min_df=2,
+                sublinear_tf=True,
+            )
+            self.tfidf_matrix = tfidf.fit_transform(self._genres)
+            self.build_index()
+
+        def build_index(self):
+            # title -> first row with that title; reversed so earlier rows overwrite later duplicates
+            rows = range(len(self._titles) - 1, -1, -1)
+            self.game_indices = dict(zip(self._titles[::-1].tolist(), rows))
 
         def recommend(self, title, n=10):
-            if title not in self.game_indices:
-                logging.warning(f"Title '{title}' not found in TF-IDF index.")
-                return []
+            return self.recommend_batch([title], n)[title]
+
+        def _top_rows(self, rows, n, chunk_size=128):
+            """Top-n most similar row indices per seed row, one sparse product per chunk of seeds."""
+            for start in range(0, len(rows), chunk_size):
+                chunk_idx = np.asarray(rows[start:start + chunk_size])
+
+                # TF-IDF rows are L2-normalized, so the dot product is the cosine similarity.
+                # Sparse matrix times a dense chunk yields a dense result directly, with no
+                # intermediate CSR for the nearly dense similarity block.
+                chunk = self.tfidf_matrix[chunk_idx].toarray()
+                sim_scores = np.ascontiguousarray((self.tfidf_matrix @ chunk.T).T)
+                sim_scores[np.arange(len(chunk_idx)), chunk_idx] = 0  # exclude self
+
+                # Partial sort: select the top n in O(N), then order only those
+                n_top = min(n, sim_scores.shape[1])
+                top_indices = np.argpartition(sim_scores, -n_top, axis=1)[:, -n_top:]
+                order = np.argsort(-np.take_along_axis(sim_scores, top_indices, axis=1), axis=1)
+                yield from np.take_along_axis(top_indices, order, axis=1)
 
-            idx = self.game_indices[title]
-            sim_scores = cosine_similarity(self.tfidf_matrix[idx], self.tfidf_matrix).flatten()
-            sim_scores[idx] = 0  # exclude self
+        def recommend_batch(self, titles, n=10):
+            """Top-n similar titles for each seed title."""
+            return {title: self.row_titles(rows) for title, rows in zip(titles, self.similar_rows(titles, n))}
 
-            top_indices = np.argsort(sim_scores)[-n:][::-1]
-            top_indices = [i for i in top_indices if i < len(self.games_df)]
+        def similar_rows(self, titles, n):
+            """Row indices of the top-n content neighbours per title, most similar first, empty for unknown titles."""
+            seeds = []
+            for title in dict.fromkeys(titles):
+                if title not in self.game_indices:
+                    logging.warning(f"Title '{title}' not found in TF-IDF index.")
+                else:
+                    seeds.append(title)
+            top_rows = dict(zip(seeds, self._top_rows([self.game_indices[title] for title in seeds], n)))
+            empty = np.empty(0, dtype=np.int64)
+            return [top_rows.get(title, empty) for title in titles]
 
-            idx_to_title = pd.Series(self.games_df["title"].values, index=np.arange(len(self.games_df)))
-            top_titles = idx_to_title[top_indices].tolist()
-            return top_titles
+        def row_titles(self, rows):
+            return self._titles[rows].tolist()